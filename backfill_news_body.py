@@ -0,0 +1,55 @@
+import csv
+import os
+import sys
+
+import pyarrow.parquet as pq
+import sqlalchemy as sa
+
+from dotenv import load_dotenv
+load_dotenv()  # .env 파일 자동 로드
+
+# -------------------------
+# rss_news.csv(.parquet) → news.body 1회성 백필
+# migrations/001_news_body.sql 적용 후 한 번 실행
+# -------------------------
+DB_URL = os.getenv("DATABASE_URL", "sqlite:///collector.db")
+engine = sa.create_engine(DB_URL, future=True, pool_pre_ping=True, pool_recycle=3600)
+
+BATCH_SIZE = 500
+csv.field_size_limit(2**31 - 1)   # 본문 컬럼이 기본 한도(128KB)를 넘을 수 있음
+
+# 이미 본문이 있는 행은 건드리지 않음 → 여러 번 돌려도 안전 (추출 실패로 ""인 행은 채움)
+UPDATE_BODY_SQL = sa.text("""
+    UPDATE news SET body = :body
+    WHERE link = :link AND (body IS NULL OR body = '')
+""")
+
+def iter_bodies(csv_path):
+    """rss_main이 같이 만드는 Parquet가 있으면 link/body 컬럼만 읽고, 없으면 CSV를 읽음"""
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    if os.path.exists(parquet_path):
+        table = pq.read_table(parquet_path, columns=["link", "body"])
+        yield from zip(table.column("link").to_pylist(), table.column("body").to_pylist())
+        return
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        for r in csv.DictReader(f):
+            yield r["link"], r["body"]
+
+def backfill(csv_path="rss_news.csv"):
+    batch, total = [], 0
+    with engine.begin() as conn:
+        for link, body in iter_bodies(csv_path):
+            if not link or not body:
+                continue
+            batch.append({"link": link, "body": body})
+            if len(batch) >= BATCH_SIZE:
+                conn.execute(UPDATE_BODY_SQL, batch)
+                total += len(batch)
+                batch.clear()
+        if batch:
+            conn.execute(UPDATE_BODY_SQL, batch)
+            total += len(batch)
+    print(f"✅ news.body backfill: {total} rows sent (본문이 이미 있던 행은 건너뜀)")
+
+if __name__ == "__main__":
+    backfill(sys.argv[1] if len(sys.argv) > 1 else "rss_news.csv")
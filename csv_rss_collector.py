@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
-import argparse, yaml, httpx, feedparser, re, json, hashlib, logging, csv
+import argparse, yaml, httpx, feedparser, re, hashlib, logging, csv, threading, time, functools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import Optional, List, Tuple
-import pandas as pd
+from typing import Dict, Optional, List, Tuple
+from urllib.parse import urlparse
 from goose3 import Goose
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 import trafilatura
+from trafilatura.utils import decode_file
 
 # -------------------------
 # 공통 설정
@@ -14,6 +17,10 @@ import trafilatura
 USER_AGENT = "rss-collector/0.2 (+httpx)"
 REQUEST_TIMEOUT = 15.0
 MAX_BODY_CHARS = 10000   # 🔥 본문은 1500자로 제한
+MIN_HOST_INTERVAL = 0.25  # 같은 호스트에 대한 최소 요청 간격(초)
+ARTICLE_WORKERS = 8       # 기사 페이지 병렬 다운로드 스레드 수
+FEED_WORKERS = 8          # 동시에 처리할 피드 수
+MAX_HTML_CHARS = 300_000  # trafilatura에 넘길 HTML 최대 길이 (거대한 페이지에서 추출 시간 상한)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("crawler")
@@ -21,7 +28,28 @@ logger = logging.getLogger("crawler")
 FEEDS_CSV = "feeds.csv"
 ARTICLES_CSV = "articles.csv"
 
-goose = Goose()
+# Goose는 생성 비용이 커서 fallback이 실제로 필요할 때 처음 만든다
+_goose = None
+
+def get_goose() -> Goose:
+    global _goose
+    if _goose is None:
+        _goose = Goose()
+    return _goose
+
+# 본문 후처리: (홍길동 기자) / 이메일 / 저작권 문구(끝까지)를 한 번에 제거한 뒤 공백 정리
+CLEAN_RE = re.compile(r"\([^)]+기자\)|[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+|(?s:무단 전재.*)")
+WS_RE = re.compile(r"\s+")
+
+# 연합뉴스 본문/제목 XPath (CSS `div.story-news.article`, `h1.tit`과 동일, script/style 텍스트 제외)
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+_TEXT_NODES = ".//text()[not(ancestor::script) and not(ancestor::style)]"
+YNA_BODY_XPATH = etree.XPath(f"(//div[{_has_class('story-news')} and {_has_class('article')}])[1]")
+YNA_TITLE_XPATH = etree.XPath(f"(//h1[{_has_class('tit')}])[1]")
+H1_XPATH = etree.XPath("(//h1)[1]")
+TEXT_XPATH = etree.XPath(_TEXT_NODES)
 
 def utcnow() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -29,52 +57,108 @@ def utcnow() -> str:
 def sha256_hexd(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8", errors="ignore")).hexdigest()
 
+# 피드 루프에서 같은 URL이 중복 체크/저장 때 반복 정규화되므로 캐시
+@functools.lru_cache(maxsize=8192)
 def canonicalize_url(url: str) -> str:
     return url.split("#", 1)[0].split("?", 1)[0].rstrip("/")
 
+def node_text(node) -> str:
+    """BeautifulSoup의 get_text(" ", strip=True)와 같은 방식으로 텍스트 노드를 합친다."""
+    return " ".join(t.strip() for t in TEXT_XPATH(node) if t.strip())
+
+def parse_html(html: bytes):
+    """응답 bytes를 그대로 넘긴다: lxml이 <meta charset>/<?xml encoding?>을 보고 직접 디코딩한다."""
+    return lxml.html.fromstring(html)
+
 def guess_lead(text: str, max_len: int = 240) -> str:
-    text = re.sub(r"\s+", " ", text or "").strip()
+    text = WS_RE.sub(" ", text or "").strip()
     return (text[:max_len] + ("…" if len(text) > max_len else ""))
 
+class HostThrottle:
+    """호스트(netloc)별로 요청 사이에 최소 MIN_HOST_INTERVAL 간격을 보장 (스레드 안전)."""
+    def __init__(self, interval: float = MIN_HOST_INTERVAL):
+        self.interval = interval
+        self._guard = threading.Lock()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._last: Dict[str, float] = {}
+
+    def wait(self, url: str):
+        host = urlparse(url).netloc
+        with self._guard:
+            lock = self._locks.setdefault(host, threading.Lock())
+        with lock:
+            delay = self._last.get(host, 0.0) + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last[host] = time.monotonic()
+
+throttle = HostThrottle()
+
 # -------------------------
 # CSV Repo
 # -------------------------
 class CsvRepo:
+    FEED_COLUMNS = [
+        "id", "outlet", "url", "active", "etag", "last_modified", "last_checked"
+    ]
+    ARTICLE_COLUMNS = [
+        "id", "outlet", "feed_id", "url", "canonical_url", "title", "summary",
+        "published_at", "author", "html_sha256", "html_path", "body",
+        "hash_sha256", "created_at"
+    ]
+
     def __init__(self):
         if not Path(FEEDS_CSV).exists():
-            pd.DataFrame(columns=[
-                "id", "outlet", "url", "active", "etag", "last_modified", "last_checked"
-            ]).to_csv(FEEDS_CSV, index=False)
+            self._append_row(FEEDS_CSV, self.FEED_COLUMNS)
 
         if not Path(ARTICLES_CSV).exists():
-            pd.DataFrame(columns=[
-                "id", "outlet", "feed_id", "url", "canonical_url", "title", "summary",
-                "published_at", "author", "html_sha256", "html_path", "body",
-                "hash_sha256", "created_at"
-            ]).to_csv(ARTICLES_CSV, index=False)
-
-    def _next_id(self, path: str) -> int:
-        df = pd.read_csv(path)
-        if df.empty:
-            return 1
-        return (pd.to_numeric(df["id"], errors="coerce").max() + 1)
+            self._append_row(ARTICLES_CSV, self.ARTICLE_COLUMNS)
+
+        # 여러 피드를 스레드로 동시에 처리하므로 append/카운터는 락으로 보호
+        self._lock = threading.Lock()
+
+        # 기존 CSV는 시작 시 한 번만 읽고, 이후에는 append-only로 기록
+        self._feed_urls, self._next_feed_id = self._scan(FEEDS_CSV, "url")
+        self._seen, self._next_article_id = self._scan(
+            ARTICLES_CSV, "canonical_url", escapechar="\\"
+        )
+
+    def is_seen(self, url: str) -> bool:
+        return canonicalize_url(url) in self._seen
+
+    @staticmethod
+    def _scan(path: str, key: str, **fmt) -> Tuple[set, int]:
+        """CSV를 한 번 훑어 key 컬럼 값 set과 다음 id(max(id)+1)를 돌려준다."""
+        values, max_id = set(), 0
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f, **fmt):
+                values.add(row[key])
+                try:
+                    max_id = max(max_id, int(float(row["id"])))
+                except (TypeError, ValueError):
+                    pass
+        return values, max_id + 1
+
+    @staticmethod
+    def _append_row(path: str, row: list, **fmt):
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f, **fmt).writerow(row)
 
     def upsert_feed(self, outlet: str, url: str):
-        df = pd.read_csv(FEEDS_CSV)
-        if url in df["url"].values:
-            return
-        new_id = self._next_id(FEEDS_CSV)
-        new_row = {
-            "id": new_id, "outlet": outlet, "url": url, "active": True,
-            "etag": "", "last_modified": "", "last_checked": utcnow()
-        }
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        df.to_csv(FEEDS_CSV, index=False)
+        with self._lock:
+            if url in self._feed_urls:
+                return
+            new_id = self._next_feed_id
+            self._next_feed_id += 1
+            self._append_row(FEEDS_CSV, [new_id, outlet, url, True, "", "", utcnow()])
+            self._feed_urls.add(url)
 
     def list_active_feeds(self) -> List[dict]:
-        df = pd.read_csv(FEEDS_CSV)
-        df = df[df["active"].astype(str) == "True"]
-        return df.to_dict(orient="records")
+        with open(FEEDS_CSV, newline="", encoding="utf-8") as f:
+            rows = [r for r in csv.DictReader(f) if r["active"] == "True"]
+        for r in rows:
+            r["id"] = int(float(r["id"]))
+        return rows
 
     def insert_article(self, feed_id: int, outlet: str, url: str, title: str,
                        summary: str, published_at: Optional[str], author: Optional[str],
@@ -82,77 +166,77 @@ class CsvRepo:
         canonical = canonicalize_url(url)
         content_key = f"{canonical}|{body[:200] if body else ''}"
         hash_key = sha256_hexd(content_key)
-
-        df = pd.read_csv(ARTICLES_CSV)
-        if canonical in df["canonical_url"].values:
-            return None
-
-        new_id = self._next_id(ARTICLES_CSV)
         if body and len(body) > MAX_BODY_CHARS:
             body = body[:MAX_BODY_CHARS]
 
-        new_row = {
-            "id": new_id,
-            "outlet": outlet,
-            "feed_id": feed_id,
-            "url": url,
-            "canonical_url": canonical,
-            "title": title,
-            "summary": summary,
-            "published_at": published_at or "",
-            "author": author or "",
-            "html_sha256": html_sha256 or "",
-            "html_path": html_path or "",
-            "body": body or "",
-            "hash_sha256": hash_key,
-            "created_at": utcnow(),
-        }
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        df.to_csv(ARTICLES_CSV, index=False, quoting=csv.QUOTE_ALL, escapechar='\\')
+        with self._lock:
+            if canonical in self._seen:
+                return None
+            new_id = self._next_article_id
+            self._next_article_id += 1
+            self._append_row(ARTICLES_CSV, [
+                new_id, outlet, feed_id, url, canonical, title, summary,
+                published_at or "", author or "", html_sha256 or "", html_path or "",
+                body or "", hash_key, utcnow(),
+            ], quoting=csv.QUOTE_ALL, escapechar="\\")
+            self._seen.add(canonical)
         return new_id
 
 # -------------------------
 # 본문 추출기
 # -------------------------
-def extract_body(html: str, url: str) -> Tuple[Optional[str], Optional[str]]:
+def trafilatura_extract(html: str) -> Tuple[Optional[str], Optional[str]]:
+    """bare_extraction으로 (title, text)를 바로 받는다 (JSON 직렬화/역직렬화 생략)."""
+    doc = trafilatura.bare_extraction(
+        html, include_comments=False, include_tables=False,
+        favor_recall=False, no_fallback=True,
+    )
+    if not doc:
+        return None, None
+    if isinstance(doc, dict):   # trafilatura 1.x는 dict, 2.x는 Document 반환
+        return doc.get("title"), doc.get("text")
+    return doc.title, doc.text
+
+def extract_body(html: bytes, url: str) -> Tuple[Optional[str], Optional[str]]:
     # 연합뉴스 전용 파서
     try:
-        soup = BeautifulSoup(html, "html.parser")
-        body_div = soup.select_one("div.story-news.article")
+        tree = parse_html(html)
+        body_div = YNA_BODY_XPATH(tree)
         if body_div:
-            text = body_div.get_text(" ", strip=True)
-            text = re.sub(r"\s+", " ", text).strip()
-            text = re.sub(r"\([^)]+기자\)", "", text)
-            text = re.sub(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+", "", text)
-            text = re.sub(r"무단 전재.*", "", text)
-            title_tag = soup.select_one("h1.tit") or soup.select_one("h1")
-            title = title_tag.get_text(" ", strip=True) if title_tag else None
+            text = node_text(body_div[0])
+            text = WS_RE.sub(" ", CLEAN_RE.sub("", text)).strip()
+            title_tag = YNA_TITLE_XPATH(tree) or H1_XPATH(tree)
+            title = node_text(title_tag[0]) if title_tag else None
             return title, text[:MAX_BODY_CHARS]
     except Exception as e:
         logger.warning("YNA parser failed: %s", e)
 
-    # trafilatura fallback
+    # trafilatura fallback (충분히 긴 본문이면 goose3는 건너뜀)
+    short = None
     try:
-        json_str = trafilatura.extract(html, output="json", include_comments=False, include_tables=False)
-        if json_str:
-            data = json.loads(json_str)
-            text = data.get("text")
-            title = data.get("title")
-            if text:
-                text = re.sub(r"\s+", " ", text).strip()
+        html_input = html[:MAX_HTML_CHARS] if len(html) > MAX_HTML_CHARS else html
+        title, text = trafilatura_extract(html_input)
+        if text:
+            text = WS_RE.sub(" ", text).strip()
+            if len(text) > 200:
                 return title, text[:MAX_BODY_CHARS]
+            short = (title, text)
     except Exception as e:
         logger.warning("trafilatura failed: %s", e)
 
     # goose3 fallback
     try:
-        article = goose.extract(raw_html=html, url=url)
+        # goose3는 bytes를 UTF-8로만 읽으므로 fallback일 때만 디코딩
+        article = get_goose().extract(raw_html=decode_file(html), url=url)
         if article.cleaned_text:
-            text = re.sub(r"\s+", " ", article.cleaned_text).strip()
+            text = WS_RE.sub(" ", article.cleaned_text).strip()
             return article.title, text[:MAX_BODY_CHARS]
     except Exception as e:
         logger.warning("goose3 failed: %s", e)
 
+    # goose3도 실패하면 짧은 trafilatura 결과라도 사용
+    if short:
+        return short
     return None, None
 
 # -------------------------
@@ -173,12 +257,10 @@ def fetch_and_process_feed(client: httpx.Client, repo: CsvRepo, feed_row: dict,
     entries = parsed.entries or []
     logger.info("Feed entries: %d", len(entries))
 
-    for i, e in enumerate(entries):
-        if limit and i >= limit:
-            break
+    def fetch_one(e) -> Optional[dict]:
         link = e.get("link") or e.get("id")
         if not link:
-            continue
+            return None
         title = (e.get("title") or "").strip()
         author = (e.get("author") or "").strip() if e.get("author") else None
         summary = (e.get("summary") or "").strip() if e.get("summary") else ""
@@ -193,29 +275,45 @@ def fetch_and_process_feed(client: httpx.Client, repo: CsvRepo, feed_row: dict,
                     pass
 
         try:
+            throttle.wait(link)
             page = client.get(link, headers={"User-Agent": USER_AGENT})
         except Exception as ex:
             logger.warning("Article fetch failed: %s err=%s", link, ex)
-            continue
+            return None
 
-        html = page.text
+        html = page.content   # httpx의 인코딩 감지/디코딩을 건너뛰고 bytes 그대로 파싱
         extracted_title, body = extract_body(html, link)
         if not body:
             body = summary or title
 
         final_title = extracted_title or title or ""
         final_summary = guess_lead(body or summary or final_title)
-
-        article_id = repo.insert_article(
+        return dict(
             feed_id=feed_id, outlet=outlet, url=link,
             title=final_title, summary=final_summary,
             published_at=published_at, author=author,
             html_sha256="", html_path="", body=body,
         )
+
+    if limit:
+        entries = entries[:limit]
+
+    # 이미 저장된 기사는 페이지 다운로드/본문 추출 전에 건너뜀
+    total = len(entries)
+    entries = [e for e in entries if not repo.is_seen(e.get("link") or e.get("id") or "")]
+    if len(entries) < total:
+        logger.info("Already seen: %d entries skipped", total - len(entries))
+
+    # 다운로드/추출만 병렬로, CSV 기록은 메인 스레드에서 순서대로
+    with ThreadPoolExecutor(max_workers=ARTICLE_WORKERS) as ex:
+        articles = [a for a in ex.map(fetch_one, entries) if a]
+
+    for article in articles:
+        article_id = repo.insert_article(**article)
         if article_id:
-            logger.info("Saved article id=%s title=%s", article_id, final_title[:80])
+            logger.info("Saved article id=%s title=%s", article_id, article["title"][:80])
         else:
-            logger.info("Duplicate skipped url=%s", link)
+            logger.info("Duplicate skipped url=%s", article["url"])
 
 # -------------------------
 # 메인
@@ -246,11 +344,22 @@ def main():
     client = httpx.Client(timeout=REQUEST_TIMEOUT, headers={"User-Agent": USER_AGENT})
     rows = repo.list_active_feeds()
 
-    for row in rows:
-        try:
-            fetch_and_process_feed(client, repo, row, limit=args.limit)
-        except Exception as e:
-            logger.exception("Feed error %s: %s", row.get("url"), e)
+    # 피드는 스레드로 동시에 처리하되, 같은 호스트의 피드는 한 번에 하나씩
+    host_locks: Dict[str, threading.Lock] = {}
+    guard = threading.Lock()
+
+    def run_feed(row: dict):
+        with guard:
+            lock = host_locks.setdefault(urlparse(row["url"]).netloc, threading.Lock())
+        with lock:
+            try:
+                fetch_and_process_feed(client, repo, row, limit=args.limit)
+            except Exception as e:
+                logger.exception("Feed error %s: %s", row.get("url"), e)
+
+    if rows:
+        with ThreadPoolExecutor(max_workers=min(FEED_WORKERS, len(rows))) as ex:
+            list(ex.map(run_feed, rows))
 
     client.close()
 
@@ -1,5 +1,17 @@
 import requests, re
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
+
+# `div.article_txt p` 안의 모든 텍스트 노드를 한 번에 가져오는 XPath
+ARTICLE_TEXT_XPATH = etree.XPath(
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' article_txt ')]"
+    "//p//text()[not(ancestor::script) and not(ancestor::style)]"
+)
+UTF8_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+# 후처리: (홍길동 기자) / 이메일 / 저작권 문구를 한 번에 제거
+CLEAN_RE = re.compile(r"\([^)]+기자\)|[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+|무단 전재.*")
+WS_RE = re.compile(r"\s+")
 
 def parse_donga(url: str) -> str:
     headers = {
@@ -10,18 +22,13 @@ def parse_donga(url: str) -> str:
         )
     }
     resp = requests.get(url, headers=headers, timeout=10)
-    resp.encoding = "utf-8"
-    soup = BeautifulSoup(resp.text, "html.parser")
+    tree = lxml.html.fromstring(resp.content, parser=UTF8_PARSER)
 
     # 바깥 div.article_txt 말고, 안쪽 모든 div.article_txt의 <p> 찾기
-    paras = soup.select("div.article_txt p")
-    text = " ".join([p.get_text(" ", strip=True) for p in paras])
+    text = " ".join(t.strip() for t in ARTICLE_TEXT_XPATH(tree) if t.strip())
 
     # 후처리
-    text = re.sub(r"\([^)]+기자\)", "", text)
-    text = re.sub(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+", "", text)
-    text = re.sub(r"무단 전재.*", "", text)
-    text = re.sub(r"\s+", " ", text).strip()
+    text = WS_RE.sub(" ", CLEAN_RE.sub("", text)).strip()
 
     return text
 
@@ -0,0 +1,4 @@
+-- 001_news_body.sql
+-- 본문을 rss_news.csv 대신 news 테이블에 직접 저장 (sentiment_worker가 CSV 조인 없이 바로 읽음)
+-- 적용 후 기존 기사는 `python backfill_news_body.py`로 한 번 채워 준다.
+ALTER TABLE news ADD COLUMN IF NOT EXISTS body TEXT;
@@ -0,0 +1,8 @@
+-- 002_news_unlabeled_idx.sql
+-- sentiment_worker의 미분석 기사 조회용 부분 인덱스
+--   WHERE sentiment IS NULL ORDER BY crawled_at DESC LIMIT :limit
+-- 태깅된 행은 인덱스에서 빠지므로 인덱스는 미분석 기사 수만큼만 유지된다.
+-- (조회가 body까지 읽으므로 INCLUDE로 커버링 인덱스를 만들어도 힙 조회는 남아서 생략)
+CREATE INDEX IF NOT EXISTS news_unlabeled_idx
+    ON news (crawled_at DESC)
+    WHERE sentiment IS NULL;
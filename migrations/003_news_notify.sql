@@ -0,0 +1,14 @@
+-- 003_news_notify.sql
+-- news에 기사가 들어오면 'new_article' 채널로 알림 → sentiment_worker가 LISTEN으로 바로 깨어남
+-- 문장 단위 트리거: executemany로 여러 건을 넣어도 같은 트랜잭션의 알림은 하나로 합쳐짐
+CREATE OR REPLACE FUNCTION notify_new_article() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('new_article', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS news_notify ON news;
+CREATE TRIGGER news_notify
+    AFTER INSERT ON news
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_new_article();
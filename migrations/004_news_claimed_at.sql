@@ -0,0 +1,4 @@
+-- 004_news_claimed_at.sql
+-- sentiment_worker가 기사를 선점한 시각 (sentiment는 태깅 전까지 NULL 유지)
+-- 워커가 죽어 선점이 풀리지 않은 행은 CLAIM_TIMEOUT_MINUTES가 지나면 다시 조회 대상이 된다.
+ALTER TABLE news ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
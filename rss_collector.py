@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
-import argparse, hashlib, json, logging, os, re, signal, sys, time, yaml
+import argparse, asyncio, functools, hashlib, logging, os, re, signal, sys, time, yaml
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
 
 import httpx, feedparser
 from goose3 import Goose
 import trafilatura
+from trafilatura.utils import decode_file
 from sqlalchemy import (
     create_engine, text, MetaData, Table, Column,
     Integer, BigInteger, String, Text, DateTime, Boolean, UniqueConstraint
 )
 from sqlalchemy.engine import Engine
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import select
 
 # -------------------------
@@ -23,14 +25,26 @@ DEFAULT_DB_URL = os.getenv("DATABASE_URL", "sqlite:///collector.db")
 HTML_DIR = Path(os.getenv("HTML_DIR", "./data/html")).resolve()
 MIN_HOST_INTERVAL = float(os.getenv("MIN_HOST_INTERVAL", "1.0"))
 MAX_BODY_CHARS = int(os.getenv("MAX_BODY_CHARS", "120000"))
+MAX_HTML_CHARS = int(os.getenv("MAX_HTML_CHARS", "300000"))   # trafilatura 입력 상한
 REQUEST_TIMEOUT = 15.0
 MAX_RETRIES = 2
+ARTICLE_WORKERS = int(os.getenv("ARTICLE_WORKERS", "8"))   # 본문 추출(CPU) 스레드 수
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "50"))
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", "8"))          # 동시에 처리할 피드 수
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("rss-collector")
 
 STOP = False
-goose = Goose()
+# Goose는 생성 비용이 커서 fallback이 실제로 필요할 때 처음 만든다
+_goose = None
+
+def get_goose() -> Goose:
+    global _goose
+    if _goose is None:
+        _goose = Goose()
+    return _goose
+WS_RE = re.compile(r"\s+")
 
 # -------------------------
 # DB schema
@@ -76,20 +90,58 @@ def utcnow() -> datetime:
 def sha256_hexd(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8", errors="ignore")).hexdigest()
 
+# 피드 루프에서 같은 URL이 중복 체크/저장 때 반복 정규화되므로 캐시
+@functools.lru_cache(maxsize=8192)
 def canonicalize_url(url: str) -> str:
     return url.split("#", 1)[0].split("?", 1)[0].rstrip("/")
 
 def guess_lead(text: str, max_len: int = 240) -> str:
-    text = re.sub(r"\s+", " ", text or "").strip()
+    text = WS_RE.sub(" ", text or "").strip()
     return (text[:max_len] + ("…" if len(text) > max_len else ""))
 
-def write_html_local(html: str) -> Tuple[str, str]:
-    HTML_DIR.mkdir(parents=True, exist_ok=True)
-    digest = hashlib.sha256(html.encode("utf-8", errors="ignore")).hexdigest()
-    path = HTML_DIR / f"{digest}.html"
-    if not path.exists():
-        path.write_text(html, encoding="utf-8", errors="ignore")
-    return digest, str(path)
+class HtmlStore:
+    """HTML_DIR/{sha256}.html 저장소. 이미 저장된 해시는 메모리 set으로 확인해 stat 호출을 생략."""
+    def __init__(self, root: Path = HTML_DIR):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._hashes = {name[:-5] for name in os.listdir(self.root) if name.endswith(".html")}
+
+    def write(self, html_bytes: bytes) -> Tuple[str, str]:
+        digest = hashlib.sha256(html_bytes).hexdigest()
+        path = self.root / f"{digest}.html"
+        if digest not in self._hashes:
+            path.write_bytes(html_bytes)
+            self._hashes.add(digest)
+        return digest, str(path)
+
+_html_store: Optional[HtmlStore] = None
+
+def write_html_local(html_bytes: bytes) -> Tuple[str, str]:
+    """응답 원본 bytes(resp.content)를 그대로 해시/저장 (decode→encode 왕복 없음)."""
+    global _html_store
+    if _html_store is None:
+        _html_store = HtmlStore()
+    return _html_store.write(html_bytes)
+
+class HostThrottle:
+    """호스트(netloc)별로 요청 사이에 최소 MIN_HOST_INTERVAL 간격을 보장 (asyncio용)."""
+    def __init__(self, interval: float = MIN_HOST_INTERVAL):
+        self.interval = interval
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last: Dict[str, float] = {}
+
+    async def wait(self, url: str):
+        host = urlparse(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self._last.get(host, 0.0) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last[host] = time.monotonic()
+
+throttle = HostThrottle()
+# goose3/trafilatura는 CPU 작업이라 이벤트 루프 밖에서 실행
+extract_pool = ThreadPoolExecutor(max_workers=ARTICLE_WORKERS)
 
 # -------------------------
 # Repo
@@ -98,12 +150,20 @@ class Repo:
     def __init__(self, engine: Engine):
         self.engine = engine
         metadata.create_all(self.engine)
+        # 이미 저장된 canonical_url / 피드 url을 메모리에 올려두고 set으로 중복 확인
+        with self.engine.begin() as conn:
+            self._seen = set(conn.execute(select(articles_table.c.canonical_url)).scalars())
+            self._feed_urls = set(conn.execute(select(feeds_table.c.url)).scalars())
+
+    def is_seen(self, url: str) -> bool:
+        return canonicalize_url(url) in self._seen
 
     def upsert_feed(self, outlet: str, url: str):
+        if url in self._feed_urls:
+            return
         with self.engine.begin() as conn:
-            row = conn.execute(select(feeds_table.c.id).where(feeds_table.c.url == url)).fetchone()
-            if row is None:
-                conn.execute(feeds_table.insert().values(outlet=outlet, url=url, active=True))
+            conn.execute(feeds_table.insert().values(outlet=outlet, url=url, active=True))
+        self._feed_urls.add(url)
 
     def list_active_feeds(self) -> List[dict]:
         with self.engine.begin() as conn:
@@ -118,49 +178,74 @@ class Repo:
                 )
             )
 
-    def insert_article(self, feed_id: int, outlet: str, url: str, title: str,
-                        summary: str, published_at: Optional[datetime], author: Optional[str],
-                        html_sha256: Optional[str], html_path: Optional[str], body: Optional[str]) -> Optional[int]:
-        canonical = canonicalize_url(url)
-        # body도 해시 키에 포함시켜서 업데이트 감지
-        content_key = f"{canonical}|{body[:200] if body else ''}"
-        hash_key = sha256_hexd(content_key)
-        if body and len(body) > MAX_BODY_CHARS:
-            body = body[:MAX_BODY_CHARS]
+    def _insert_ignore(self):
+        # canonical_url 충돌 시 무시 (dialect별 ON CONFLICT DO NOTHING)
+        dialect = self.engine.dialect.name
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        elif dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            return articles_table.insert().prefix_with("IGNORE")
+        return insert(articles_table).on_conflict_do_nothing(index_elements=["canonical_url"])
+
+    def insert_articles(self, rows: List[dict]) -> int:
+        """피드 단위로 모은 기사들을 한 트랜잭션에 executemany로 저장. 저장된 건수 반환."""
+        if not rows:
+            return 0
         with self.engine.begin() as conn:
-            try:
-                res = conn.execute(articles_table.insert().values(
-                    outlet=outlet, feed_id=feed_id, url=url, canonical_url=canonical,
-                    title=title, summary=summary, published_at=published_at, author=author,
-                    html_sha256=html_sha256, html_path=html_path, body=body, hash_sha256=hash_key,
-                    created_at=utcnow()
-                ))
-                return res.inserted_primary_key[0]
-            except IntegrityError:
-                return None
+            res = conn.execute(self._insert_ignore(), rows)
+        self._seen.update(r["canonical_url"] for r in rows)
+        return max(res.rowcount, 0)
+
+def build_article_row(feed_id: int, outlet: str, url: str, title: str,
+                      summary: str, published_at: Optional[datetime], author: Optional[str],
+                      html_sha256: Optional[str], html_path: Optional[str], body: Optional[str]) -> dict:
+    canonical = canonicalize_url(url)
+    # body도 해시 키에 포함시켜서 업데이트 감지
+    content_key = f"{canonical}|{body[:200] if body else ''}"
+    hash_key = sha256_hexd(content_key)
+    if body and len(body) > MAX_BODY_CHARS:
+        body = body[:MAX_BODY_CHARS]
+    return dict(
+        outlet=outlet, feed_id=feed_id, url=url, canonical_url=canonical,
+        title=title, summary=summary, published_at=published_at, author=author,
+        html_sha256=html_sha256, html_path=html_path, body=body, hash_sha256=hash_key,
+        created_at=utcnow(),
+    )
 
 # -------------------------
 # Extraction
 # -------------------------
-def extract_body(html: str, url: str) -> Tuple[Optional[str], Optional[str]]:
-    # 1) trafilatura
+def trafilatura_extract(html: str) -> Tuple[Optional[str], Optional[str]]:
+    """bare_extraction으로 (title, text)를 바로 받는다 (JSON 직렬화/역직렬화 생략)."""
+    doc = trafilatura.bare_extraction(
+        html, include_comments=False, include_tables=False,
+        favor_recall=False, no_fallback=True,
+    )
+    if not doc:
+        return None, None
+    if isinstance(doc, dict):   # trafilatura 1.x는 dict, 2.x는 Document 반환
+        return doc.get("title"), doc.get("text")
+    return doc.title, doc.text
+
+def extract_body(html: bytes, url: str) -> Tuple[Optional[str], Optional[str]]:
+    # 1) trafilatura (bytes를 받아 charset을 직접 감지)
     try:
-        json_str = trafilatura.extract(html, output="json", include_comments=False, include_tables=False)
-        if json_str:
-            data = json.loads(json_str)
-            text = data.get("text")
-            title = data.get("title")
-            if text and len(text.strip()) > 200:
-                text = re.sub(r"\s+", " ", text).strip()
-                return title, text
+        # 거대한 페이지는 잘라서 넘기고, trafilatura 자체 fallback 단계는 끔 (goose3가 뒤에 있음)
+        html_input = html[:MAX_HTML_CHARS] if len(html) > MAX_HTML_CHARS else html
+        title, text = trafilatura_extract(html_input)
+        if text and len(text.strip()) > 200:
+            text = WS_RE.sub(" ", text).strip()
+            return title, text
     except Exception as e:
         logger.warning("trafilatura failed: %s", e)
 
-    # 2) goose3
+    # 2) goose3 (bytes는 UTF-8만 처리하므로 fallback일 때만 디코딩)
     try:
-        article = goose.extract(raw_html=html, url=url)
+        article = get_goose().extract(raw_html=decode_file(html), url=url)
         if article.cleaned_text and len(article.cleaned_text.strip()) > 200:
-            text = re.sub(r"\s+", " ", article.cleaned_text).strip()
+            text = WS_RE.sub(" ", article.cleaned_text).strip()
             return article.title, text
     except Exception as e:
         logger.warning("goose3 failed: %s", e)
@@ -170,13 +255,28 @@ def extract_body(html: str, url: str) -> Tuple[Optional[str], Optional[str]]:
 # -------------------------
 # Core
 # -------------------------
-def fetch_and_process_feed(client: httpx.Client, repo: Repo, feed_row: dict):
+async def fetch_and_process_feed(client: httpx.AsyncClient, repo: Repo, feed_row: dict):
     feed_id = feed_row["id"]
     outlet = feed_row["outlet"]
     feed_url = feed_row["url"]
 
+    loop = asyncio.get_running_loop()
+
+    # 저장된 etag/last_modified로 conditional GET → 변경 없는 피드는 304로 바로 종료
+    headers = {"User-Agent": USER_AGENT}
+    if feed_row.get("etag"):
+        headers["If-None-Match"] = feed_row["etag"]
+    if feed_row.get("last_modified"):
+        headers["If-Modified-Since"] = feed_row["last_modified"]
+
     logger.info("Fetch feed %s (%s)", outlet, feed_url)
-    resp = client.get(feed_url, headers={"User-Agent": USER_AGENT})
+    resp = await client.get(feed_url, headers=headers)
+    if resp.status_code == 304:
+        logger.info("Feed not modified %s", feed_url)
+        await loop.run_in_executor(
+            None, repo.update_feed_state, feed_id, feed_row.get("etag"), feed_row.get("last_modified")
+        )
+        return
     if resp.status_code != 200:
         logger.warning("Feed fetch failed %s", feed_url)
         return
@@ -185,10 +285,21 @@ def fetch_and_process_feed(client: httpx.Client, repo: Repo, feed_row: dict):
     entries = parsed.entries or []
     logger.info("Feed entries: %d", len(entries))
 
-    for e in entries:
+    # 이미 저장된 기사는 페이지 다운로드/본문 추출 전에 건너뜀
+    total = len(entries)
+    entries = [e for e in entries if not repo.is_seen(e.get("link") or e.get("id") or "")]
+    if len(entries) < total:
+        logger.info("Already seen: %d entries skipped", total - len(entries))
+
+    def process_page(html: bytes, link: str) -> Tuple[Optional[str], Optional[str], str, str]:
+        extracted_title, body = extract_body(html, link)
+        html_sha, html_path = write_html_local(html)
+        return extracted_title, body, html_sha, html_path
+
+    async def fetch_one(e) -> Optional[dict]:
         link = e.get("link") or e.get("id")
         if not link:
-            continue
+            return None
         title = (e.get("title") or "").strip()
         author = (e.get("author") or "").strip() if e.get("author") else None
         summary = (e.get("summary") or "").strip() if e.get("summary") else ""
@@ -203,30 +314,40 @@ def fetch_and_process_feed(client: httpx.Client, repo: Repo, feed_row: dict):
                     pass
 
         try:
-            page = client.get(link, headers={"User-Agent": USER_AGENT})
+            await throttle.wait(link)
+            page = await client.get(link, headers={"User-Agent": USER_AGENT})
         except Exception as ex:
             logger.warning("Article fetch failed: %s err=%s", link, ex)
-            continue
+            return None
 
-        html = page.text
-        extracted_title, body = extract_body(html, link)
+        extracted_title, body, html_sha, html_path = await loop.run_in_executor(
+            extract_pool, process_page, page.content, link
+        )
         if not body:
             body = summary or title
 
-        html_sha, html_path = write_html_local(html)
         final_title = extracted_title or title or ""
         final_summary = guess_lead(body or summary or final_title)
 
-        article_id = repo.insert_article(
+        return build_article_row(
             feed_id=feed_id, outlet=outlet, url=link,
             title=final_title, summary=final_summary,
             published_at=published_at, author=author,
             html_sha256=html_sha, html_path=html_path, body=body,
         )
-        if article_id:
-            logger.info("Saved article id=%s title=%s", article_id, final_title[:80])
-        else:
-            logger.info("Duplicate skipped url=%s", link)
+
+    # 기사 페이지는 한 피드 안에서 동시에 요청 (HTTP/2로 같은 호스트 연결 재사용)
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(fetch_one(e)) for e in entries]
+    rows = [t.result() for t in tasks if t.result()]
+
+    saved = await loop.run_in_executor(None, repo.insert_articles, rows)
+    logger.info("Saved %d articles (duplicates skipped: %d) from %s", saved, len(rows) - saved, outlet)
+
+    # 기사 저장까지 끝난 뒤에 validator를 기록 (중간에 실패하면 다음 polling에서 다시 받음)
+    await loop.run_in_executor(
+        None, repo.update_feed_state, feed_id, resp.headers.get("etag"), resp.headers.get("last-modified")
+    )
 
 # -------------------------
 # CLI
@@ -252,19 +373,27 @@ def main():
     for outlet, url in feeds:
         repo.upsert_feed(outlet, url)
 
-    client = httpx.Client(timeout=REQUEST_TIMEOUT, headers={"User-Agent": USER_AGENT})
-
-    def run_once():
+    async def run_once():
         rows = repo.list_active_feeds()
-        for row in rows:
-            try:
-                fetch_and_process_feed(client, repo, row)
-            except Exception as e:
-                logger.exception("Feed error %s: %s", row.get("url"), e)
-
-    run_once() if args.once else run_once()
-
-    client.close()
+        async with httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT, headers={"User-Agent": USER_AGENT},
+            http2=True, limits=httpx.Limits(max_connections=MAX_CONNECTIONS),
+        ) as client:
+            # 피드는 동시에 처리하되, 같은 호스트의 피드는 한 번에 하나씩
+            feed_sem = asyncio.Semaphore(FEED_WORKERS)
+            host_locks: Dict[str, asyncio.Lock] = {}
+
+            async def run_feed(row: dict):
+                host_lock = host_locks.setdefault(urlparse(row["url"]).netloc, asyncio.Lock())
+                async with feed_sem, host_lock:
+                    try:
+                        await fetch_and_process_feed(client, repo, row)
+                    except Exception as e:
+                        logger.exception("Feed error %s: %s", row.get("url"), e)
+
+            await asyncio.gather(*(run_feed(row) for row in rows))
+
+    asyncio.run(run_once())
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,11 @@
-import pandas as pd
+import csv
 import feedparser
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
 from goose3 import Goose
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 from datetime import datetime, UTC
 import re
 import sqlalchemy as sa
@@ -26,62 +29,82 @@ engine = sa.create_engine(
 # -------------------------
 import json
 
-def save_articles(rows):
-    with engine.begin() as conn:
-            for row in rows:
-                # 기사 저장
-                result = conn.execute(sa.text("""
-                    INSERT INTO news (
-                        outlet, outlet_img, feed_url, title, summary, link, published, crawled_at, like_count, emotion_rating
-                    )
-                    VALUES (
-                        :outlet, :outlet_img, :feed_url, :title, :summary, :link, :published, :crawled_at, :like_count, :emotion_rating
-                    )
-                    ON CONFLICT (link) DO NOTHING
-                    RETURNING id
-                """), {
-                    "outlet": row["outlet"],
-                    "outlet_img": "/img/khan.png",
-                    "feed_url": row["feed_url"],
-                    "title": row["title"],
-                    "summary": row["summary"],
-                    "link": row["link"],
-                    "published": row["published"],
-                    "crawled_at": row["crawled_at"],
-                    "like_count": 0,
-                    "emotion_rating": 0.0
-                })
-
+news_table = sa.table(
+    "news",
+    sa.column("id"), sa.column("outlet"), sa.column("outlet_img"), sa.column("feed_url"),
+    sa.column("title"), sa.column("summary"), sa.column("link"), sa.column("published"),
+    sa.column("crawled_at"), sa.column("like_count"), sa.column("emotion_rating"),
+    sa.column("body"),
+)
 
-            article_id = result.scalar_one_or_none()
-            if not article_id:
-                # 이미 존재하는 경우 id 가져오기
-                article_id = conn.execute(sa.text("""
-                    SELECT id FROM news WHERE link = :link
-                """), {"link": row["link"]}).scalar_one()
+def news_upsert():
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    stmt = insert(news_table)
+    # 충돌 시 no-op UPDATE → 기존 기사도 RETURNING으로 id를 돌려받아 추가 SELECT가 필요 없음
+    # (본문이 NULL이거나 추출 실패로 ""였던 기존 기사는 이번에 받은 body로 채움)
+    return stmt.on_conflict_do_update(
+        index_elements=["link"],
+        set_={"link": stmt.excluded.link,
+              "body": sa.func.coalesce(sa.func.nullif(news_table.c.body, ""), stmt.excluded.body)},
+    ).returning(news_table.c.id, news_table.c.link)
 
-            # 이미지 저장
+def save_articles(rows):
+    # 여러 피드에 같은 기사가 실리면 link가 겹침 → 한 INSERT 안에서 같은 행을 두 번 건드리면
+    # Postgres가 ON CONFLICT DO UPDATE를 거부하므로 link별 첫 번째 행만 남김
+    unique = {}
+    for row in rows:
+        unique.setdefault(row["link"], row)
+    rows = list(unique.values())
+    if not rows:
+        return
+    with engine.begin() as conn:
+        # 기사 저장 (executemany 한 번)
+        result = conn.execute(news_upsert(), [{
+            "outlet": row["outlet"],
+            "outlet_img": "/img/khan.png",
+            "feed_url": row["feed_url"],
+            "title": row["title"],
+            "summary": row["summary"],
+            "link": row["link"],
+            "published": row["published"],
+            "crawled_at": row["crawled_at"],
+            "like_count": 0,
+            "emotion_rating": 0.0,
+            "body": row["body"]
+        } for row in rows])
+        ids = {link: article_id for article_id, link in result}
+
+        images, thumbnails = [], []
+        for row in rows:
+            article_id = ids.get(row["link"])
             for idx, img in enumerate(row.get("images", [])):
-                conn.execute(sa.text("""
-                    INSERT INTO news_image (news_id, src, alt)
-                    VALUES (:news_id, :src, :alt)
-                    ON CONFLICT DO NOTHING
-                """), {
+                images.append({
                     "news_id": article_id,
                     "src": img.get("src"),
                     "alt": img.get("alt", "")
                 })
+                # 첫 번째 이미지를 우선 thumbnail로 사용
+                if idx == 0:
+                    thumbnails.append({"thumbnail": img.get("src"), "id": article_id})
+
+        # 이미지 저장
+        if images:
+            conn.execute(sa.text("""
+                INSERT INTO news_image (news_id, src, alt)
+                VALUES (:news_id, :src, :alt)
+                ON CONFLICT DO NOTHING
+            """), images)
 
-                # 썸네일 업데이트 (news.thumbnail이 NULL일 때만)
-                if idx == 0:  # 첫 번째 이미지를 우선 thumbnail로 사용
-                    conn.execute(sa.text("""
-                        UPDATE news
-                        SET thumbnail = :thumbnail
-                        WHERE id = :id AND thumbnail IS NULL
-                    """), {
-                        "thumbnail": img.get("src"),
-                        "id": article_id
-                    })
+        # 썸네일 업데이트 (news.thumbnail이 NULL일 때만)
+        if thumbnails:
+            conn.execute(sa.text("""
+                UPDATE news
+                SET thumbnail = :thumbnail
+                WHERE id = :id AND thumbnail IS NULL
+            """), thumbnails)
 
 
 
@@ -93,47 +116,49 @@ rss_list = [
     ("경향신문", "https://www.khan.co.kr/rss/rssdata/total_news.xml"),
 ]
 
-goose = Goose()
+# Goose는 생성 비용이 커서 fallback이 실제로 필요할 때 처음 만든다
+_goose = None
+
+def get_goose() -> Goose:
+    global _goose
+    if _goose is None:
+        _goose = Goose()
+    return _goose
+
+# 불필요한 패턴: (홍길동 기자) / 이메일 / 저작권 문구
+CLEAN_RE = re.compile(r"\([^)]+기자\)|[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+|무단 전재.*")
+WS_RE = re.compile(r"\s+")
+
+# 언론사별 본문 영역 (CSS `div#articleBody`, `div.art_body`)
+BODY_XPATHS = {
+    "국민일보": etree.XPath("(//div[@id='articleBody'])[1]"),
+    "경향신문": etree.XPath("(//div[contains(concat(' ', normalize-space(@class), ' '), ' art_body ')])[1]"),
+}
+# 본문 안의 <p> 텍스트 노드 / src가 비어 있지 않은 <img>를 한 번의 C 레벨 탐색으로 수집
+P_TEXT_XPATH = etree.XPath(".//p//text()[not(ancestor::script) and not(ancestor::style)]")
+IMG_XPATH = etree.XPath(".//img[normalize-space(@src)]")
 
 # -------------------------
 # 본문 추출기
 # -------------------------
-def extract_body_and_images(html: str, outlet: str):
-    soup = BeautifulSoup(html, "html.parser")
-
-    if outlet == "국민일보":
-        body_div = soup.select_one("div#articleBody")
-
-    elif outlet == "경향신문":
-        body_div = soup.select_one("div.art_body")
+def extract_body_and_images(html: bytes, outlet: str):
+    body_xpath = BODY_XPATHS.get(outlet)
+    if body_xpath is None or not html:
+        return "", []
 
-    else:
-        body_div = None
+    # bytes 그대로 파싱: 인코딩은 lxml이 <meta charset>/<?xml encoding?>을 보고 판단
+    tree = lxml.html.fromstring(html)
 
+    body_div = body_xpath(tree)
     if not body_div:
         return "", []
+    body_div = body_div[0]
 
-    texts = []
-    images = []
-
-    for elem in body_div.find_all(["p", "img"]):
-        if elem.name == "p":
-            text = elem.get_text(" ", strip=True)
-            if text:
-                texts.append(text)
-        elif elem.name == "img":
-            src = elem.get("src")
-            alt = elem.get("alt", "")
-            if src:
-                images.append({"src": src, "alt": alt})
-
-    text = " ".join(texts)
+    text = " ".join(t.strip() for t in P_TEXT_XPATH(body_div) if t.strip())
+    images = [{"src": img.get("src"), "alt": img.get("alt", "")} for img in IMG_XPATH(body_div)]
 
     # 불필요한 패턴 제거
-    text = re.sub(r"\([^)]+기자\)", "", text)  # (홍길동 기자)
-    text = re.sub(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+", "", text)  # 이메일
-    text = re.sub(r"무단 전재.*", "", text)  # 저작권 문구
-    text = re.sub(r"\s+", " ", text).strip()  # 공백 정리
+    text = WS_RE.sub(" ", CLEAN_RE.sub("", text)).strip()  # 패턴 제거 후 공백 정리
 
     return text, images
 
@@ -153,17 +178,17 @@ for outlet, feed_url in rss_list:
             break
 
         link = entry.get("link")
-        title = re.sub(r"\s+", " ", entry.get("title", "").strip())
-        summary = re.sub(r"\s+", " ", entry.get("summary", "").strip())
+        title = WS_RE.sub(" ", entry.get("title", "").strip())
+        summary = WS_RE.sub(" ", entry.get("summary", "").strip())
         published = entry.get("published", "")
 
         body = ""
         try:
             resp = requests.get(link, headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
-            # 기본 BeautifulSoup 전용 파서
-            body, images = extract_body_and_images(resp.text, outlet)
+            # 언론사 전용 lxml 파서
+            body, images = extract_body_and_images(resp.content, outlet)
             if not body:
-                article = goose.extract(raw_html=resp.text, url=link)
+                article = get_goose().extract(raw_html=resp.text, url=link)
                 body = article.cleaned_text.strip() if article.cleaned_text else ""
         except Exception as e:
             print(f"[{outlet}] 기사 크롤링 실패: {e}")
@@ -184,9 +209,27 @@ for outlet, feed_url in rss_list:
 # -------------------------
 # 저장
 # -------------------------
-df = pd.DataFrame(rows)
-df.to_csv("rss_news.csv", index=False, encoding="utf-8-sig")
-print("총 수집 기사:", len(df))
+CSV_FIELDS = ["outlet", "feed_url", "title", "link", "summary", "published", "body", "images", "crawled_at"]
+with open("rss_news.csv", "w", newline="", encoding="utf-8-sig") as f:
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, quoting=csv.QUOTE_MINIMAL)
+    writer.writeheader()
+    writer.writerows(rows)
+print("총 수집 기사:", len(rows))
+
+# 분석용 Parquet (본문이 대부분이라 zstd 압축 효과가 큼, 필요한 컬럼만 읽기 가능)
+PARQUET_SCHEMA = pa.schema([
+    ("outlet", pa.string()),
+    ("feed_url", pa.string()),
+    ("title", pa.string()),
+    ("link", pa.string()),
+    ("summary", pa.string()),
+    ("published", pa.string()),
+    ("body", pa.string()),
+    ("images", pa.list_(pa.struct([("src", pa.string()), ("alt", pa.string())]))),
+    ("crawled_at", pa.string()),
+])
+with pq.ParquetWriter("rss_news.parquet", PARQUET_SCHEMA, compression="zstd") as writer:
+    writer.write_table(pa.Table.from_pylist(rows, schema=PARQUET_SCHEMA))
 
 # DB 저장
 save_articles(rows)
@@ -1,7 +1,14 @@
-import os, json, time
+import os, csv, json, time, asyncio, random, traceback
+from typing import Literal
+from itertools import islice
 import sqlalchemy as sa
-from openai import OpenAI
-from prometheus_client import Counter, start_http_server
+from sqlalchemy.ext.asyncio import create_async_engine
+import tiktoken
+from openai import (
+    AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError,
+)
+from prometheus_client import Counter, Histogram, start_http_server
+from pydantic import BaseModel, ConfigDict, Field
 
 from dotenv import load_dotenv
 load_dotenv()  # .env 파일 자동 로드
@@ -9,266 +16,618 @@ load_dotenv()  # .env 파일 자동 로드
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DB_URL = os.getenv("DATABASE_URL", "sqlite:///collector.db")
 
-engine = sa.create_engine(
-    DB_URL,
-    future=True,
+# DB 연결 (async 드라이버: Postgres는 asyncpg, 로컬 SQLite는 aiosqlite)
+# DB 왕복 동안에도 같은 이벤트 루프에서 LLM 호출이 계속 진행됨
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def async_db_url(url):
+    url = sa.engine.make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+engine = create_async_engine(
+    async_db_url(DB_URL),
     pool_pre_ping=True,       # ✅ 끊어진 커넥션 자동 감지
     pool_recycle=3600         # ✅ 1시간마다 커넥션 재활용
 )
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
+# 재시도는 아래 create_response에서 한 곳으로 관리 (SDK 자체 재시도는 끔)
+client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+
+# OpenAI 동시 요청 수 / 분당 요청 수 / 분당 토큰 수 제한 (tier 한도에 맞춰 조절)
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "20"))
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+
+
+class RateLimiter:
+    """분당 한도를 초당 속도로 채워지는 토큰 버킷 (소수 속도 지원, 최대 window초 분량까지 몰아서 사용 가능)."""
+
+    def __init__(self, per_minute: int, window: float = 1.0):
+        self.rate = per_minute / 60                       # 초당 채워지는 양
+        self.capacity = max(1.0, self.rate * window)      # RPM 30이면 0.5/s, 한 번에 1건까지
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, cost: int = 1):
+        cost = min(cost, self.capacity)   # 한도보다 큰 요청이 영원히 대기하지 않도록
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                await asyncio.sleep((cost - self._tokens) / self.rate)
+
+
+llm_semaphore = asyncio.Semaphore(OPENAI_CONCURRENCY)
+rate_limiter = RateLimiter(OPENAI_RPM)
+token_limiter = RateLimiter(OPENAI_TPM, window=60.0)
+
+# 429 / 타임아웃 / 연결 오류 / 5xx는 지수 백오프 + jitter로 재시도
+LLM_MAX_ATTEMPTS = 3
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+
+async def with_retries(call, *args, attempts=LLM_MAX_ATTEMPTS, **kwargs):
+    """OpenAI 호출 공통 재시도 (실시간 요청과 Batch 파일/작업 API 모두 여기를 거침)"""
+    for attempt in range(attempts):
+        try:
+            return await call(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == attempts - 1:
+                raise
+            delay = min(30, 2 ** attempt) + random.random()
+            print(f"⚠️ OpenAI 일시 오류 ({type(e).__name__}), {delay:.1f}s 후 재시도")
+            await asyncio.sleep(delay)
+
+
+async def create_response(tokens=0, **kwargs):
+    """tokens: 요청 예상 토큰 수 (입력 + max_output_tokens) → 분당 토큰 한도에 반영"""
+    async def send():
+        async with llm_semaphore:
+            await rate_limiter.acquire()
+            if tokens:
+                await token_limiter.acquire(tokens)
+            with llm_latency.time():
+                return await client.responses.create(**kwargs)
+    return await with_retries(send)
 
 # Prometheus Counters
 processed_counter = Counter("articles_processed_total", "Total articles processed")
 success_counter   = Counter("articles_success_total", "Articles successfully tagged")
 fail_counter      = Counter("articles_fail_total", "Articles failed to tag")
-
-# Start Prometheus metrics server on port 8000
-start_http_server(8000)
-
-PROMPT_TEMPLATE = """
-다음 뉴스 기사를 읽고 반드시 **유효한 JSON만** 출력하세요.
-추가 텍스트나 설명은 절대 쓰지 마세요.
-
-## 출력 형식 (필수, 누락 금지)
-{{
-  "category": "카테고리1",  # 반드시 하나만
-  "sentiment": "감정라벨",
-  "political_orientation": "PROGRESSIVE | CONSERVATIVE | MODERATE",
-  "confidence": 0.0~1.0,
-  "rationale": "근거 설명 (1~2문장)",
-  "summary": "기사 요약 (본문을 3~4문장으로 압축)"
-}}
-
-## 카테고리 후보 (반드시 이 중에서 하나만 선택, 영어 코드 사용)
-- politics: Politics (Government, policy, diplomacy, elections)
-- society: Society (Incidents, accidents, labor, education, crime)
-- economy: Economy (Business, finance, industry, trade, stock, prices)
-- international: International (International relations, war, diplomacy, overseas events)
-- culture: Culture (Movies, drama, entertainment, tradition)
-- sports: Sports (Baseball, soccer, basketball, Olympics, game results)
-- it_science: IT & Science (Technology, science, internet, AI)
-
-## 감정 후보 (반드시 이 중에서만 선택)
-- hope_encourage: 성취, 희망, 승리, 격려, 긍정적 메시지
-- anger_criticism: 분노, 비판, 불만, 논란
-- anxiety_crisis: 불안, 위기, 공포, 갈등
-- sad_shock: 슬픔, 충격, 재난, 사고, 패배
-- neutral_factual: 중립적, 단순 사실 전달
-- fun_interest: 재미, 흥미, 유쾌
-
-## 정치 성향 후보 (반드시 이 중에서 하나만 선택)
-- PROGRESSIVE
-- CONSERVATIVE
-- MODERATE
-- NONE (해당 없음, 예: 스포츠, 연예 기사)
-
----
-
-## 예시 1
-제목: "태권도 배준서, 그랑프리 챌린지 우승…5초 남기고 역전 드라마"
-본문: "한국 태권도 선수가 경기 종료 직전 역전승으로 금메달을 차지했다."
-출력:
-{{"category": "sports", "sentiment": "hope_encourage", "political_orientation": "NONE", "confidence": 0.9, "rationale": "스포츠 경기에서의 극적인 승리를 전달하는 긍정적 기사이다."}}
-
-## 예시 2
-제목: "여자농구 챔피언 BNK, 개막전서 후지쓰에 10점 차 패배"
-본문: "BNK가 개막전에서 후지쓰에 패배했다."
-출력:
-{{"category": "sports", "sentiment": "sad_shock", "political_orientation": "NONE", "confidence": 0.85, "rationale": "스포츠 경기의 패배 소식을 전하며 실망과 아쉬움을 드러낸다."}}
-
-## 예시 3
-제목: "대통령, 강릉 일원 재난사태 선포"
-본문: "가뭄 피해 확산을 막기 위해 강릉에 재난 사태가 선포됐다."
-출력:
-{{"category": "politics", "sentiment": "neutral_factual", "political_orientation": "CONSERVATIVE", "confidence": 0.8, "rationale": "정부의 공식 발표를 전달하는 사실 중심 기사이다."}}
-
-## 예시 4
-제목: "삼성전자, 2분기 영업이익 12조 달성"
-본문: "삼성전자가 2분기에 12조 원의 영업이익을 기록했다."
-출력:
-{{"category": "economy", "sentiment": "hope_encourage", "political_orientation": "NONE", "confidence": 0.88, "rationale": "긍정적인 실적 발표로 희망적인 분위기를 전달한다."}}
-
-## 예시 5
-제목: "북, 러시아에 병력 파견 결정"
-본문: "북한이 러시아와의 조약 체결 직후 러시아에 병력을 파견하기로 했다."
-출력:
-{{"category": "international", "sentiment": "anxiety_crisis", "political_orientation": "CONSERVATIVE", "confidence": 0.85, "rationale": "국제 갈등과 군사 파병 소식으로 불안과 위기감을 조성한다."}}
-
-## 예시 6
-제목: "유명 배우 신작 영화 개봉 첫날 매진"
-본문: "유명 배우의 신작 영화가 개봉 첫날 매진을 기록했다."
-출력:
-{{"category": "culture", "sentiment": "hope_encourage", "political_orientation": "NONE", "confidence": 0.9, "rationale": "문화 콘텐츠의 성공을 다룬 긍정적인 기사이다."}}
-
-## 예시 7
-제목: "국회, 전기요금 인상 두고 여야 격렬한 공방"
-본문: "전기요금 인상안을 두고 여야가 국회 본회의에서 날 선 공방을 벌였다. 일부 의원들은 정부 정책을 강하게 비판했다."
-출력:
-{{"category": "politics", "sentiment": "anger_criticism", "political_orientation": "PROGRESSIVE", "confidence": 0.9, "rationale": "정부 정책을 둘러싼 정치적 갈등과 비판을 중심으로 다룬 기사이다."}}
-
-## 예시 8
-제목: "강아지가 스케이트보드 타고 도심 질주…시민들 웃음"
-본문: "서울 도심에서 한 반려견이 스케이트보드를 타고 거리를 달려 시민들의 눈길을 사로잡았다. 현장에서는 웃음과 환호가 이어졌다."
-출력:
-{{"category": "society", "sentiment": "fun_interest", "political_orientation": "NONE", "confidence": 0.92, "rationale": "재미있고 흥미로운 사회적 장면을 전달하는 기사이다."}}
-
----
-
-## 실제 분류할 기사
-제목: {title}
-본문: {body}
-
-출력은 반드시 JSON만!
+skipped_counter   = Counter("articles_skipped_total", "Tag updates skipped (row already tagged by another worker)")
+input_tokens_counter  = Counter("llm_input_tokens_total", "LLM input tokens")
+output_tokens_counter = Counter("llm_output_tokens_total", "LLM output tokens")
+# 동시성/배치 크기 조절할 때 꼬리 지연을 보기 위한 실시간 호출 지연 (대기열/rate limit 대기 시간 제외)
+llm_latency = Histogram("llm_latency_seconds", "Realtime LLM call latency", buckets=(0.2, 0.5, 1, 2, 5, 10, 30))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+Category = Literal["politics", "society", "economy", "international", "culture", "sports", "it_science"]
+Sentiment = Literal["hope_encourage", "anger_criticism", "anxiety_crisis", "sad_shock", "neutral_factual", "fun_interest"]
+PoliticalOrientation = Literal["PROGRESSIVE", "CONSERVATIVE", "MODERATE", "NONE"]
+
+
+class ClassifyResult(BaseModel):
+    """LLM 출력 스키마 (Structured Outputs로 API가 형식과 후보 값을 강제)."""
+    model_config = ConfigDict(extra="forbid")
+
+    category: Category
+    sentiment: Sentiment
+    political_orientation: PoliticalOrientation
+    confidence: float
+    rationale: str = Field(description="근거 설명 (1~2문장)")
+    summary: str = Field(description="기사 요약 (본문을 3~4문장으로 압축)")
+
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "name": "classify_result",
+    "schema": ClassifyResult.model_json_schema(),
+    "strict": True,
+}
+
+# 후보 값은 스키마 enum이 강제하므로 지시문에는 각 값의 의미만 짧게 둠
+STATIC_PROMPT = """
+뉴스 기사의 카테고리, 감정, 정치 성향을 분류하고 근거(1~2문장)와 요약(3~4문장)을 작성하세요.
+
+- category: politics(정부·정책·외교·선거), society(사건·사고·노동·교육·범죄), economy(기업·금융·산업·무역·물가), international(국제 관계·전쟁·해외), culture(영화·드라마·연예·전통), sports(경기·결과), it_science(기술·과학·인터넷·AI)
+- sentiment: hope_encourage(성취·희망·승리·격려), anger_criticism(분노·비판·불만·논란), anxiety_crisis(불안·위기·공포·갈등), sad_shock(슬픔·충격·재난·사고·패배), neutral_factual(단순 사실 전달), fun_interest(재미·흥미·유쾌)
+- political_orientation: PROGRESSIVE, CONSERVATIVE, MODERATE, NONE(스포츠·연예 등 해당 없음)
 """
 
-def classify_article(article):
-    prompt = PROMPT_TEMPLATE.format(
-        title=article["title"], 
-        body=str(article.get("body", ""))[:1500]
+# few-shot 예시는 few_shot_examples.json에 모아 두고, 헷갈리는 감정(FEW_SHOT_CLASSES)만 프롬프트에 붙임
+# (FEW_SHOT_CLASSES="" 이면 예시 없이, 감정별로 빼 보면서 A/B 비교)
+FEW_SHOT_PATH = os.getenv("FEW_SHOT_PATH", "few_shot_examples.json")
+FEW_SHOT_CLASSES = {c.strip() for c in os.getenv("FEW_SHOT_CLASSES", "fun_interest").split(",") if c.strip()}
+
+def load_few_shot(path=FEW_SHOT_PATH, classes=FEW_SHOT_CLASSES):
+    if not classes or not os.path.exists(path):
+        return ""
+    with open(path, encoding="utf-8") as f:
+        examples = json.load(f)
+    return "".join(
+        f'\n## 예시\n제목: "{ex["title"]}"\n본문: "{ex["body"]}"\n출력:\n'
+        f'{json.dumps(ex["output"], ensure_ascii=False)}\n'
+        for ex in examples if ex["output"]["sentiment"] in classes
     )
+
+STATIC_PROMPT += load_few_shot()
+
+# 본문은 글자 수가 아니라 토큰 수로 자름 → 기사마다 프롬프트 크기가 일정
+BODY_TOKEN_BUDGET = int(os.getenv("BODY_TOKEN_BUDGET", "1500"))
+encoding = tiktoken.get_encoding("o200k_base")   # gpt-4o-mini 토크나이저
+# 스크랩한 본문에 <|endoftext|> 같은 문자열이 있어도 예외 없이 일반 텍스트로 세도록 encode_ordinary 사용
+STATIC_PROMPT_TOKENS = len(encoding.encode_ordinary(STATIC_PROMPT))
+
+USER_HEADER = "## 실제 분류할 기사\n제목: "
+USER_BODY_LABEL = "\n본문: "
+USER_FIXED_TOKENS = len(encoding.encode_ordinary(USER_HEADER + USER_BODY_LABEL))
+
+def truncate_tokens(text, budget=BODY_TOKEN_BUDGET):
+    """(잘린 텍스트, 토큰 수)를 돌려준다 → 토큰 수를 다시 세지 않아도 됨"""
+    ids = encoding.encode_ordinary(text)
+    if len(ids) <= budget:
+        return text, len(ids)
+    # 토큰 경계가 한글 글자(UTF-8 3바이트) 중간일 수 있으니 잘린 바이트는 버림 (U+FFFD 방지)
+    return encoding.decode_bytes(ids[:budget]).decode("utf-8", errors="ignore"), budget
+
+def build_request(article):
+    """Responses API 요청 body와 입력 토큰 추정치 (body는 실시간 호출과 Batch API가 같이 사용)."""
+    body, body_tokens = truncate_tokens(str(article.get("body") or ""))
+    title = str(article["title"])
+    # system prefix/고정 문구는 미리 센 값, 제목만 새로 셈 (rate limiter용 추정치)
+    input_tokens = STATIC_PROMPT_TOKENS + USER_FIXED_TOKENS + len(encoding.encode_ordinary(title)) + body_tokens
+    return {
+        "model": "gpt-4o-mini",
+        # 고정 system 메시지를 먼저, 기사별로 달라지는 제목/본문은 마지막 user 메시지로
+        "input": [
+            {"role": "system", "content": STATIC_PROMPT},
+            {"role": "user", "content": f"{USER_HEADER}{title}{USER_BODY_LABEL}{body}"},
+        ],
+        "temperature": 0.2,
+        "max_output_tokens": 800,
+        "text": {"format": RESPONSE_FORMAT},
+    }, input_tokens
+
+def parse_tag(text):
+    # json_schema(strict) 응답이라 그대로 파싱/검증만 하면 됨
+    return ClassifyResult.model_validate_json(text).model_dump()
+
+async def classify_article(article):
     # print(article["title"])
-    resp = client.responses.create(
-        model="gpt-4o-mini",
-        input=prompt,
-        temperature=0.2,
-        max_output_tokens=800,
+    request, input_tokens = build_request(article)
+    resp = await create_response(tokens=input_tokens + request["max_output_tokens"], **request)
+    # 토큰 카운터는 Batch 결과와 같이 API가 돌려준 usage 기준 (스키마/메시지 오버헤드 포함)
+    if resp.usage:
+        input_tokens_counter.inc(resp.usage.input_tokens)
+        output_tokens_counter.inc(resp.usage.output_tokens)
+    return parse_tag(resp.output_text)
+
+# -------------------------
+# Batch API (지연에 민감하지 않은 대량 처리: 비용 50% ↓)
+# -------------------------
+# 0이면 Batch 경로를 쓰지 않음 (기본값). Batch는 결과가 최대 24h 늦어지므로 백필처럼 밀린 기사가 많을 때만 켬
+# 켤 때는 크롤링 1회 분량(rss_main max_articles=100)보다 크게 잡아야 평소 새 기사는 실시간으로 처리됨 (예: 1000)
+BATCH_MIN_ROWS = int(os.getenv("OPENAI_BATCH_MIN_ROWS", "0"))
+BATCH_POLL_INTERVAL = int(os.getenv("OPENAI_BATCH_POLL_INTERVAL", "30"))
+BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+BATCH_IO_ATTEMPTS = 5   # 파일 업로드/작업 생성/결과 다운로드 재시도 횟수 (실패하면 선점한 행 전체가 밀림)
+
+def response_output_text(body):
+    """Batch 결과 줄의 response.body(Responses 객체 dict)에서 출력 텍스트만 모은다."""
+    return "".join(
+        part.get("text", "")
+        for item in body.get("output", []) if item.get("type") == "message"
+        for part in item.get("content", []) if part.get("type") == "output_text"
+    )
+
+async def classify_batch(rows):
+    """rows 순서대로 tag dict 또는 Exception 리스트를 돌려준다 (asyncio.gather와 같은 모양)."""
+    lines = [
+        json.dumps({
+            "custom_id": str(i), "method": "POST", "url": "/v1/responses",
+            "body": build_request(row)[0],
+        }, ensure_ascii=False)
+        for i, row in enumerate(rows)
+    ]
+    batch_file = await with_retries(
+        client.files.create, attempts=BATCH_IO_ATTEMPTS,
+        file=("classify.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch",
+    )
+    batch = await with_retries(
+        client.batches.create, attempts=BATCH_IO_ATTEMPTS,
+        input_file_id=batch_file.id, endpoint="/v1/responses", completion_window="24h",
     )
-    text = resp.output_text.strip()
+    print(f"📦 batch {batch.id} 제출 ({len(rows)}건)")
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        print(f"⚠️ JSON decode 실패. 원본 응답:\n{text}")
-        # fallback: JSON 추출만 시도
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1:
+        while batch.status not in BATCH_DONE:
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            # 배치가 최대 24h 걸려도 선점이 만료돼 다른 워커가 중복 제출하지 않도록 갱신
+            await refresh_claims(rows)
             try:
-                return json.loads(text[start:end+1])
-            except:
-                pass
+                batch = await with_retries(client.batches.retrieve, batch.id)
+            except RETRYABLE_ERRORS as e:
+                # 서버 쪽 배치는 계속 돌고 있으므로 포기하지 않고 다음 폴링에서 다시 확인
+                print(f"⚠️ batch {batch.id} 상태 조회 실패 ({type(e).__name__}), {BATCH_POLL_INTERVAL}s 후 재시도")
+    except BaseException:
+        # 종료(취소)나 예기치 못한 오류로 결과를 못 받게 되면 서버 쪽 배치도 취소 (선점은 해제되어 다시 처리됨)
+        try:
+            await with_retries(client.batches.cancel, batch.id)
+            print(f"🛑 batch {batch.id} 취소 요청")
+        except Exception as e:
+            print(f"⚠️ batch {batch.id} 취소 실패: {e}")
         raise
 
-import pandas as pd
-
-import pandas as pd
-import sqlalchemy as sa
-import json, time, traceback
-
-# DB 연결
-engine = sa.create_engine(DB_URL, future=True, pool_pre_ping=True, pool_recycle=3600)
+    results = [RuntimeError(f"batch {batch.id} {batch.status}: 결과 없음")] * len(rows)
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = await with_retries(client.files.content, file_id, attempts=BATCH_IO_ATTEMPTS)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            idx = int(item["custom_id"])
+            resp = item.get("response") or {}
+            if item.get("error") or resp.get("status_code") != 200:
+                results[idx] = RuntimeError(f"batch request failed: {item.get('error') or resp.get('body')}")
+                continue
+            usage = resp["body"].get("usage") or {}
+            input_tokens_counter.inc(usage.get("input_tokens", 0))
+            output_tokens_counter.inc(usage.get("output_tokens", 0))
+            try:
+                results[idx] = parse_tag(response_output_text(resp["body"]))
+            except Exception as e:
+                results[idx] = e
+    return results
 
 # 1) DB에서 sentiment NULL 기사 가져오기
-def fetch_unlabeled_from_db(limit=10):
-    with engine.begin() as conn:
-        rows = conn.execute(sa.text("""
-            SELECT id, link, title, summary
-            FROM news
+# 여러 워커 프로세스가 같이 돌아도 겹치지 않도록 가져오면서 바로 claimed_at으로 선점 표시
+# (sentiment는 서비스가 읽는 enum 값만 담도록 태깅 전까지 NULL 그대로 둠)
+# Postgres는 FOR UPDATE SKIP LOCKED로 다른 워커가 잡고 있는 행을 건너뜀 (SQLite는 DB 단위 잠금이라 불필요)
+# 워커가 죽어서 풀리지 않은 선점은 CLAIM_TIMEOUT_MINUTES가 지나면 다시 가져갈 수 있음
+CLAIM_TIMEOUT_MINUTES = int(os.getenv("CLAIM_TIMEOUT_MINUTES", "60"))
+
+def claim_sql():
+    if engine.dialect.name == "postgresql":
+        cutoff = "CURRENT_TIMESTAMP - make_interval(mins => :minutes)"
+        skip_locked = "FOR UPDATE SKIP LOCKED"
+    else:
+        cutoff = "datetime('now', '-' || :minutes || ' minutes')"
+        skip_locked = ""
+    return sa.text(f"""
+        UPDATE news SET claimed_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM news
             WHERE sentiment IS NULL
+              AND (claimed_at IS NULL OR claimed_at < {cutoff})
             ORDER BY crawled_at DESC
             LIMIT :limit
-        """), {"limit": limit}).mappings().all()
+            {skip_locked}
+        )
+        RETURNING id, link, title, summary, COALESCE(body, '') AS body
+    """)
+
+async def fetch_unlabeled_from_db(limit=10):
+    async with engine.begin() as conn:
+        rows = (await conn.execute(claim_sql(), {"minutes": CLAIM_TIMEOUT_MINUTES, "limit": limit})).mappings().all()
         return [dict(r) for r in rows]
 
-# 2) CSV에서 body 보강하기
-def attach_body(rows, csv_path="rss_news.csv"):
-    df = pd.read_csv(csv_path)
-    df = df.set_index("link")  # 빠른 lookup
-    enriched = []
-    for row in rows:
-        link = row["link"]
-        if link in df.index:
-            row["body"] = str(df.loc[link, "body"])
-        else:
-            row["body"] = ""
-        enriched.append(row)
-    return enriched
+# 태깅/저장에 실패해 아직 sentiment가 NULL인 행은 선점을 풀어 다음 조회(다른 워커 포함)에서 재시도
+RELEASE_CLAIM_SQL = sa.text("""
+    UPDATE news SET claimed_at = NULL
+    WHERE id IN :ids AND sentiment IS NULL
+""").bindparams(sa.bindparam("ids", expanding=True))
+
+async def release_claims(rows):
+    if not rows:
+        return
+    async with engine.begin() as conn:
+        await conn.execute(RELEASE_CLAIM_SQL, {"ids": [row["id"] for row in rows]})
+
+# Batch 결과를 기다리는 동안에는 폴링할 때마다 claimed_at을 갱신해 선점이 만료되지 않게 함
+REFRESH_CLAIM_SQL = sa.text("""
+    UPDATE news SET claimed_at = CURRENT_TIMESTAMP
+    WHERE id IN :ids AND sentiment IS NULL
+""").bindparams(sa.bindparam("ids", expanding=True))
+
+async def refresh_claims(rows):
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(REFRESH_CLAIM_SQL, {"ids": [row["id"] for row in rows]})
+    except Exception as e:
+        # 갱신 실패로 배치 자체를 버리지는 않음 (다음 폴링에서 다시 시도)
+        print(f"⚠️ claim refresh failed: {e}")
+
+# 2) 본문은 news.body에 같이 저장됨 (migrations/001_news_body.sql, backfill_news_body.py)
+csv.field_size_limit(2**31 - 1)   # CSV 폴백 경로: 본문 컬럼이 기본 한도(128KB)를 넘을 수 있음
 
 # 3) 감정분석 결과 저장하기
-def save_tag(article_link, tag):
+# ✅ sentiment → emotion 매핑
+SENTIMENT_TO_EMOTION = {
+    "hope_encourage": "POSITIVE",
+    "fun_interest": "POSITIVE",
+    "neutral_factual": "NEUTRAL",
+    "anger_criticism": "NEGATIVE",
+    "sad_shock": "NEGATIVE",
+    "anxiety_crisis": "NEGATIVE",
+}
+
+UPDATE_TAG_SQL = sa.text("""
+    UPDATE news
+    SET category              = :cat,
+        sentiment             = :sent,
+        emotion               = :emo,   -- 상위 감정
+        confidence            = :conf,
+        rationale             = :rat,
+        summary               = :sum,
+        political_orientation = :pol,   -- ✅ 추가
+        tagged_at             = now()
+    WHERE link = :link
+      AND sentiment IS NULL   -- 이미 태깅된 행은 덮어쓰지 않음 (중복 워커 대비)
+""")
+
+# Postgres(asyncpg)는 executemany의 행 수를 알려주지 않으므로, 컬럼별 배열을 unnest해서
+# UPDATE 1문장으로 처리하고 RETURNING된 행 수를 실제 갱신 건수로 사용
+UPDATE_TAGS_UNNEST_SQL = sa.text("""
+    UPDATE news AS n
+    SET category              = t.cat,
+        sentiment             = t.sent,
+        emotion               = t.emo,
+        confidence            = t.conf,
+        rationale             = t.rat,
+        summary               = t.sum,
+        political_orientation = t.pol,
+        tagged_at             = now()
+    FROM unnest(
+        CAST(:link AS text[]), CAST(:cat AS text[]), CAST(:sent AS text[]), CAST(:emo AS text[]),
+        CAST(:conf AS float8[]), CAST(:rat AS text[]), CAST(:sum AS text[]), CAST(:pol AS text[])
+    ) AS t(link, cat, sent, emo, conf, rat, sum, pol)
+    WHERE n.link = t.link
+      AND n.sentiment IS NULL
+    RETURNING n.link
+""")
+TAG_ARRAY_KEYS = ("link", "cat", "sent", "emo", "conf", "rat", "sum", "pol")
+
+def tag_params(article_link, tag):
     sentiment = tag.get("sentiment", "neutral_factual")
-
-    # ✅ sentiment → emotion 매핑
-    sentiment_to_emotion = {
-        "hope_encourage": "POSITIVE",
-        "fun_interest": "POSITIVE",
-        "neutral_factual": "NEUTRAL",
-        "anger_criticism": "NEGATIVE",
-        "sad_shock": "NEGATIVE",
-        "anxiety_crisis": "NEGATIVE",
+    emotion = SENTIMENT_TO_EMOTION.get(sentiment.lower(), "NEUTRAL")
+    return {
+        "link": article_link,
+        # ✅ enum 상수와 맞추기 위해 대문자로 변환
+        "cat": tag.get("category", "").upper(),
+        "sent": sentiment.upper(),
+        "emo": emotion,  # 이미 POSITIVE/NEGATIVE/NEUTRAL
+        "conf": float(tag.get("confidence", 0.0) or 0.0),
+        "rat": tag.get("rationale", ""),
+        "sum": tag.get("summary", ""),
+        "pol": tag.get("political_orientation", "MODERATE").upper()  # 기본값 MODERATE
     }
-    emotion = sentiment_to_emotion.get(sentiment.lower(), "NEUTRAL")
-
-    with engine.begin() as conn:
-        conn.execute(sa.text("""
-            UPDATE news
-            SET category              = :cat,
-                sentiment             = :sent,
-                emotion               = :emo,   -- 상위 감정
-                confidence            = :conf,
-                rationale             = :rat,
-                summary               = :sum,
-                political_orientation = :pol,   -- ✅ 추가
-                tagged_at             = now()
-            WHERE link = :link
-        """), {
-            "link": article_link,
-            # ✅ enum 상수와 맞추기 위해 대문자로 변환
-            "cat": tag.get("category", "").upper(),
-            "sent": sentiment.upper(),
-            "emo": emotion,  # 이미 POSITIVE/NEGATIVE/NEUTRAL
-            "conf": float(tag.get("confidence", 0.0) or 0.0),
-            "rat": tag.get("rationale", ""),
-            "sum": tag.get("summary", ""),
-            "pol": tag.get("political_orientation", "MODERATE").upper()  # 기본값 MODERATE
-        })
+
+async def save_tags_bulk(tagged):
+    """[(link, tag), ...]를 한 트랜잭션에서 UPDATE (commit 1회). 실제로 갱신된 행 수를 돌려준다."""
+    if not tagged:
+        return 0
+    params = [tag_params(link, tag) for link, tag in tagged]
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            arrays = {key: [p[key] for p in params] for key in TAG_ARRAY_KEYS}
+            result = await conn.execute(UPDATE_TAGS_UNNEST_SQL, arrays)
+            return len(result.all())
+        # SQLite는 executemany의 rowcount가 전체 합계라 그대로 사용
+        return (await conn.execute(UPDATE_TAG_SQL, params)).rowcount
+
+async def save_tag(article_link, tag):
+    return await save_tags_bulk([(article_link, tag)])
 
 
 
 def fetch_unlabeled_from_csv(limit=10):
-    df = pd.read_csv("rss_news.csv")
     # 아직 감정분석 안 된 것만 필터링하려면 article_tag 테이블과 조인 대신, 임시로 전부 다 가져오기
-    rows = df.head(limit).to_dict(orient="records")
+    with open("rss_news.csv", newline="", encoding="utf-8-sig") as f:
+        rows = list(islice(csv.DictReader(f), limit))
     return rows
 
 
-def fetch_unlabeled(limit=10):
-    with engine.begin() as conn:
-        rows = conn.execute(sa.text("""
-            SELECT n.id, n.title, n.summary, n.link
+async def fetch_unlabeled(limit=10):
+    async with engine.begin() as conn:
+        rows = (await conn.execute(sa.text("""
+            SELECT n.id, n.title, n.summary, n.link, COALESCE(n.body, '') AS body
             FROM news n
             WHERE n.sentiment IS NULL
             ORDER BY n.crawled_at DESC
             LIMIT :limit
-        """), {"limit": limit}).mappings().all()
+        """), {"limit": limit})).mappings().all()
         return [dict(r) for r in rows]
 
 
 
-import traceback
+# -------------------------
+# LLM 응답 → DB 저장 파이프라인
+# 응답이 오는 대로 큐에 넣고, 저장 태스크가 최대 SAVE_BATCH_SIZE개씩 모아 UPDATE
+# (느린 응답을 기다리는 동안 먼저 끝난 결과의 DB 저장이 같이 진행됨)
+# -------------------------
+SAVE_QUEUE_SIZE = 64
+SAVE_BATCH_SIZE = 32
+SAVE_DONE = object()   # 생산자가 모두 끝났음을 알리는 sentinel
 
-def main():
+def report_failure(row, e):
+    fail_counter.inc()
+    print(f"❌ error tagging {row['link']}: {e}")
+    traceback.print_exception(e)
+
+async def save_batch(tagged):
+    """저장에 성공한 건수를 돌려준다."""
+    try:
+        updated = await save_tags_bulk(tagged)
+    except Exception as e:
+        fail_counter.inc(len(tagged))
+        print(f"❌ error saving {len(tagged)} tags: {e}")
+        traceback.print_exc()
+        return 0
+    success_counter.inc(updated)
+    if updated < len(tagged):
+        skipped_counter.inc(len(tagged) - updated)
+        print(f"↷ {len(tagged) - updated} tags skipped (already tagged)")
+    for link, tag in tagged:
+        print(f"✔ tagged {link} → {tag.get('sentiment')}")
+    return updated
+
+async def tag_and_enqueue(row, queue):
+    processed_counter.inc()
+    try:
+        tag = await classify_article(row)
+    except Exception as e:
+        report_failure(row, e)
+        return
+    await queue.put((row["link"], tag))
+
+async def save_consumer(queue):
+    saved = 0
+    while True:
+        item = await queue.get()
+        if item is SAVE_DONE:
+            return saved
+        items, done = [item], False
+        while not queue.empty() and len(items) < SAVE_BATCH_SIZE:
+            item = queue.get_nowait()
+            if item is SAVE_DONE:
+                done = True
+                break
+            items.append(item)
+        saved += await save_batch(items)
+        if done:
+            return saved
+
+# 실시간 경로는 100건씩, Batch API는 쌓인 기사를 크게 한 번에 선점해서 작업 하나로 제출
+REALTIME_LIMIT = 100
+BATCH_CLAIM_LIMIT = int(os.getenv("OPENAI_BATCH_CLAIM_LIMIT", "5000"))
+# Batch 작업이 실패(또는 한 건도 저장 못 함)하면 이 시간 동안은 Batch 제출을 쉬고 실시간 경로로만 처리
+BATCH_RETRY_DELAY = int(os.getenv("OPENAI_BATCH_RETRY_DELAY", "600"))
+batch_paused_until = 0.0
+
+async def process_rows(rows, use_batch=False):
+    """선점한 rows를 분류/저장하고 저장된 건수를 돌려준다 (남은 선점은 항상 해제)."""
+    if not rows:
+        return 0
+    queue = asyncio.Queue(maxsize=SAVE_QUEUE_SIZE)
+    consumer = asyncio.create_task(save_consumer(queue))
+    try:
+        # 감정분석 실행: Batch API면 결과를 한 번에 받고, 실시간이면 동시에 보내면서 끝나는 대로 저장
+        if use_batch:
+            results = await classify_batch(rows)
+            for row, tag in zip(rows, results):
+                processed_counter.inc()
+                if isinstance(tag, BaseException):
+                    report_failure(row, tag)
+                    continue
+                await queue.put((row["link"], tag))
+        else:
+            await asyncio.gather(*(tag_and_enqueue(row, queue) for row in rows))
+
+        # 남은 결과까지 저장되면 종료
+        await queue.put(SAVE_DONE)
+        return await consumer
+    finally:
+        consumer.cancel()
+        # 저장된 행은 sentiment가 바뀌어 있으므로, 선점 표시가 그대로인 행만 되돌아감
+        await release_claims(rows)
+
+async def run_batch_job(rows):
+    """백그라운드 태스크: Batch 결과(최대 24h)를 기다리는 동안에도 main 루프는 새 기사를 실시간 처리."""
+    global batch_paused_until
+    try:
+        saved = await process_rows(rows, use_batch=True)
+        print(f"📦 batch job done: {saved}/{len(rows)} saved")
+    except Exception as e:
+        saved = 0
+        fail_counter.inc(len(rows))
+        print(f"❌ batch job failed ({len(rows)} rows): {e}")
+        traceback.print_exc()
+    if not saved:
+        # 풀린 선점을 바로 다시 Batch로 제출해 실패를 반복하지 않도록 잠시 쉼
+        batch_paused_until = time.monotonic() + BATCH_RETRY_DELAY
+        print(f"⏸️ batch 제출 {BATCH_RETRY_DELAY}s 보류 (그동안 실시간 처리)")
+
+async def drain(batch_job, wakeup):
+    """미분석 기사가 없을 때까지 처리하고, 진행 중인 Batch 작업(없으면 None)을 돌려준다."""
     while True:
-        # 1. DB에서 미분석 기사 조회
-        unlabeled = fetch_unlabeled_from_db(100)
-        if not unlabeled:
-            print("No new articles. sleep…")
-            time.sleep(30)
-            break
-
-        # 2. CSV에서 body 붙이기
-        rows = attach_body(unlabeled)
-
-        # 3. 감정분석 실행
-        for row in rows:
+        if batch_job is not None and batch_job.done():
+            batch_job = None
+        if BATCH_MIN_ROWS and batch_job is None and time.monotonic() >= batch_paused_until:
+            rows = await fetch_unlabeled_from_db(BATCH_CLAIM_LIMIT)
+            if len(rows) >= BATCH_MIN_ROWS:
+                batch_job = asyncio.create_task(run_batch_job(rows))
+                batch_job.add_done_callback(lambda t: wakeup.set())   # 끝나면 루프를 깨워 다음 작업 확인
+                continue
+        else:
+            # Batch를 안 쓰거나, Batch 작업이 도는 동안(또는 실패 후 보류 중) 새로 들어온 기사는 실시간 경로로
+            rows = await fetch_unlabeled_from_db(REALTIME_LIMIT)
+        if not await process_rows(rows):
+            return batch_job
+
+# -------------------------
+# 새 기사 알림 (Postgres LISTEN/NOTIFY, migrations/003_news_notify.sql 트리거)
+# 알림이 오면 바로 깨어나고, 알림이 없으면 IDLE_TIMEOUT마다 한 번 확인
+# SQLite 등 LISTEN이 없는 DB나 LISTEN 연결이 끊긴 동안은 POLL_INTERVAL 간격으로 폴링
+# -------------------------
+NOTIFY_CHANNEL = "new_article"
+IDLE_TIMEOUT = int(os.getenv("IDLE_TIMEOUT", "300"))
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "30"))
+
+async def open_listener(wakeup):
+    url = sa.engine.make_url(DB_URL)
+    if url.get_backend_name() != "postgresql":
+        return None
+    import asyncpg
+    # LISTEN은 풀에 돌아가지 않는 전용 커넥션에서 유지
+    try:
+        conn = await asyncpg.connect(url.set(drivername="postgresql").render_as_string(hide_password=False))
+        await conn.add_listener(NOTIFY_CHANNEL, lambda *args: wakeup.set())
+    except (OSError, asyncpg.PostgresError) as e:
+        print(f"⚠️ LISTEN 연결 실패 ({e}), {POLL_INTERVAL}s 폴링으로 대체")
+        return None
+    # DB 재시작/네트워크 끊김으로 연결이 닫히면 바로 깨워서 main 루프가 다시 연결하게 함
+    conn.add_termination_listener(lambda c: wakeup.set())
+    return conn
+
+def listening(listener):
+    return listener is not None and not listener.is_closed()
+
+async def main():
+    # Prometheus 메트릭 서버는 실행할 때만 띄움 (import 시 포트 충돌 방지)
+    start_http_server(METRICS_PORT)
+    wakeup = asyncio.Event()
+    listener = None
+    batch_job = None
+    try:
+        while True:
+            if not listening(listener):
+                if listener is not None:
+                    print("⚠️ LISTEN 연결이 끊겨 다시 연결합니다")
+                listener = await open_listener(wakeup)
+            # 처리 중에 들어온 알림은 다음 wait에서 바로 깨우도록 먼저 clear
+            wakeup.clear()
+            batch_job = await drain(batch_job, wakeup)
+            print("No new articles. waiting…")
             try:
-                tag = classify_article(row)  # LLM 호출
-                save_tag(row["link"], tag)  # DB 업데이트
-                print(f"✔ tagged {row['link']} → {tag.get('sentiment')}")
-            except Exception as e:
-                print(f"❌ error tagging {row['link']}: {e}")
-                traceback.print_exc()
-
-        break
+                await asyncio.wait_for(wakeup.wait(), IDLE_TIMEOUT if listening(listener) else POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if batch_job is not None and not batch_job.done():
+            batch_job.cancel()   # 선점은 process_rows의 finally에서 해제됨
+            try:
+                await batch_job
+            except asyncio.CancelledError:
+                pass
+        if listening(listener):
+            await listener.close()
+        await engine.dispose()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())